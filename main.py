@@ -4,6 +4,16 @@ import random
 from PIL import Image, ImageTk
 import datetime
 import math
+import csv
+import json
+import os
+import sys
+import heapq
+import copy
+import multiprocessing
+import queue
+import traceback
+import numpy as np
 import matplotlib.pyplot as plt                                                                                 #type: ignore
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg                                                 #type: ignore
 
@@ -73,6 +83,15 @@ class PassengerWagon(Wagon):
     def get_passenger_count(self):
         return len(self.__passengers)
 
+    def get_passengers(self):
+        return self.__passengers
+
+    def set_passengers(self, passengers):
+        self.__passengers = list(passengers)
+
+    def drop_passengers(self, destination):
+        self.__passengers = [p for p in self.__passengers if p.get_destination() != destination]
+
     def is_full(self):
         return len(self.__passengers) >= self.__seats
 
@@ -201,6 +220,294 @@ class Train:
     def needs_processing(self):
         return self.__is_waiting and not self.__passengers_processed
 
+class FleetTrain(Train):
+    def __init__(self, fleet, index, number, wagons):
+        super().__init__(number, None, [])
+        self.__fleet = fleet
+        self.__index = index
+        for wagon in wagons:
+            self.add_wagon(wagon)
+
+    def get_index(self):
+        return self.__index
+
+    def get_current_station(self):
+        return self.__fleet.get_current_station(self.__index)
+
+    def get_target_station(self):
+        return self.__fleet.get_target_station(self.__index)
+
+    def get_position(self):
+        return self.__fleet.get_position(self.__index)
+
+    def get_current_line(self):
+        return self.__fleet.get_current_line(self.__index)
+
+    def is_waiting(self):
+        return self.__fleet.is_waiting(self.__index)
+
+    def start_waiting(self):
+        self.__fleet.start_waiting(self.__index)
+
+    def end_waiting(self):
+        self.__fleet.end_waiting(self.__index)
+
+    def choose_next_station(self):
+        self.__fleet.choose_next_station(self.__index)
+
+    def move(self, step=0.01):
+        self.__fleet.move_train(self.__index, step)
+
+    def process_passengers(self):
+        self.__fleet.process_passengers(self.__index)
+
+    def needs_processing(self):
+        return self.__fleet.needs_processing(self.__index)
+
+class Fleet:
+    # Состояние всех поездов хранится в массивах NumPy, объекты FleetTrain - лишь представления
+    def __init__(self, trains, lines, step=0.01, wait_ticks=20, seed=None, line_keys=None, stations=()):
+        self.__lines = list(lines)
+        self.__line_index = {key: i for i, key in enumerate(range(len(self.__lines)) if line_keys is None
+                                                            else line_keys)}
+        self.__line_keys = list(self.__line_index)
+        self.__stations = []
+        self.__station_ids = {}
+        self.__station_names = {}
+        self.__wait_ticks = wait_ticks
+        self.__seed = np.uint64((seed if seed is not None else random.getrandbits(64)) % 2 ** 64)
+
+        for station in stations:
+            self.__intern(station)
+        line_ids = {id(line): i for i, line in enumerate(self.__lines)}
+        starts = np.array([self.__intern(l.get_start_station()) for l in self.__lines], dtype=np.intp)
+        ends = np.array([self.__intern(l.get_end_station()) for l in self.__lines], dtype=np.intp)
+        current = [self.__intern(t.get_current_station()) for t in trains]
+
+        outgoing = np.flatnonzero(starts != ends)
+        order = np.argsort(starts[outgoing], kind='stable')
+        counts = np.bincount(starts[outgoing], minlength=len(self.__stations))
+        self.__line_ends = ends
+        self.__neighbor_lines = outgoing[order]
+        self.__neighbor_counts = counts
+        self.__neighbor_offsets = np.cumsum(counts) - counts
+
+        count = len(trains)
+        self.__train_ids = np.arange(count, dtype=np.intp)
+        self.__current = np.array(current, dtype=np.intp)
+        self.__targets = np.array([self.__intern(t.get_target_station()) if t.get_target_station() else -1
+                                   for t in trains], dtype=np.intp)
+        self.__line_ids = np.array([line_ids.get(id(t.get_current_line()), -1) for t in trains], dtype=np.intp)
+        self.__positions = np.array([t.get_position() for t in trains], dtype=np.float64)
+        self.__speeds = np.full(count, step, dtype=np.float64)
+        self.__waiting = np.array([t.is_waiting() for t in trains], dtype=bool)
+        self.__processed = np.array([not t.needs_processing() for t in trains], dtype=bool)
+        self.__wait_timers = np.where(self.__waiting, wait_ticks, 0).astype(np.int32)
+        self.__draws = np.zeros(count, dtype=np.uint64)
+
+        self.__trains = [FleetTrain(self, i, t.get_number(), t.get_wagons()) for i, t in enumerate(trains)]
+
+    def __intern(self, station):
+        station_id = self.__station_ids.get(station)
+        if station_id is None:
+            station_id = len(self.__stations)
+            self.__station_ids[station] = station_id
+            self.__station_names[station.get_name()] = station_id
+            self.__stations.append(station)
+        return station_id
+
+    def __station(self, station_id):
+        return self.__stations[station_id] if station_id >= 0 else None
+
+    def __uniform(self, indices):
+        # Случайное число зависит только от seed, номера поезда и числа его выборов,
+        # поэтому результат не меняется при разбиении поездов между процессами
+        x = self.__train_ids[indices].astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= self.__draws[indices] * np.uint64(0xD1B54A32D192ED03) + self.__seed
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+        self.__draws[indices] += np.uint64(1)
+        return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+    def __choose_next(self, indices):
+        if indices.size == 0:
+            return
+        current = self.__current[indices]
+        counts = self.__neighbor_counts[current]
+        has_neighbors = counts > 0
+        picks = np.full(indices.size, -1, dtype=np.intp)
+        offsets = self.__neighbor_offsets[current[has_neighbors]]
+        offsets += (self.__uniform(indices[has_neighbors]) * counts[has_neighbors]).astype(np.intp)
+        picks[has_neighbors] = self.__neighbor_lines[offsets]
+
+        targets = np.full(indices.size, -1, dtype=np.intp)
+        targets[has_neighbors] = self.__line_ends[picks[has_neighbors]]
+        self.__line_ids[indices] = picks
+        self.__targets[indices] = targets
+        self.__positions[indices] = 0.0
+
+    def __arrive(self, indices):
+        self.__current[indices] = self.__targets[indices]
+        self.__waiting[indices] = True
+        self.__processed[indices] = False
+        self.__wait_timers[indices] = self.__wait_ticks
+        self.__choose_next(indices)
+
+    def __reorder(self, order):
+        self.__train_ids = self.__train_ids[order]
+        self.__current = self.__current[order]
+        self.__targets = self.__targets[order]
+        self.__line_ids = self.__line_ids[order]
+        self.__positions = self.__positions[order]
+        self.__speeds = self.__speeds[order]
+        self.__waiting = self.__waiting[order]
+        self.__processed = self.__processed[order]
+        self.__wait_timers = self.__wait_timers[order]
+        self.__draws = self.__draws[order]
+        # Список меняется на месте: касса, построенная по get_trains(), видит новый состав флота
+        trains = [self.__trains[i] for i in order]
+        self.__trains[:] = [FleetTrain(self, i, t.get_number(), t.get_wagons()) for i, t in enumerate(trains)]
+
+    def advance(self, scale=1.0):
+        waiting = np.flatnonzero(self.__waiting & self.__processed)
+        released = self.__wait_timers[waiting] <= 0
+        self.__waiting[waiting[released]] = False
+
+        free = ~self.__waiting
+        self.__choose_next(np.flatnonzero(free & (self.__line_ids < 0)))
+
+        moving = np.flatnonzero(free & (self.__line_ids >= 0))
+        self.__positions[moving] += self.__speeds[moving] * scale
+        arrived = moving[self.__positions[moving] >= 1.0]
+        self.__arrive(arrived)
+
+        # Таймер уменьшается после движения: поезд стоит ровно wait_ticks тиков
+        self.__wait_timers[waiting[~released]] -= 1
+        return arrived
+
+    def move_train(self, index, step=0.01):
+        if self.__waiting[index]:
+            return
+        indices = np.array([index], dtype=np.intp)
+        if self.__line_ids[index] < 0:
+            self.__choose_next(indices)
+            return
+        self.__positions[index] += step
+        if self.__positions[index] >= 1.0:
+            self.__arrive(indices)
+
+    def choose_next_station(self, index):
+        self.__choose_next(np.array([index], dtype=np.intp))
+
+    def start_waiting(self, index):
+        self.__waiting[index] = True
+        self.__wait_timers[index] = self.__wait_ticks
+
+    def end_waiting(self, index):
+        self.__waiting[index] = False
+        self.__wait_timers[index] = 0
+
+    def process_passengers(self, index):
+        self.__processed[index] = True
+
+    def needs_processing(self, index):
+        return bool(self.__waiting[index] and not self.__processed[index])
+
+    def is_waiting(self, index):
+        return bool(self.__waiting[index])
+
+    def get_current_station(self, index):
+        return self.__station(self.__current[index])
+
+    def get_target_station(self, index):
+        return self.__station(self.__targets[index])
+
+    def get_position(self, index):
+        return float(self.__positions[index])
+
+    def get_current_line(self, index):
+        line_id = self.__line_ids[index]
+        return self.__lines[line_id] if line_id >= 0 else None
+
+    def get_train_id(self, index):
+        return int(self.__train_ids[index])
+
+    def set_speed(self, index, speed):
+        self.__speeds[index] = speed
+
+    def get_owner_stations(self):
+        # Ожидающий поезд принадлежит своей станции, движущийся - станции назначения
+        settled = self.__waiting | (self.__line_ids < 0)
+        return np.where(settled, self.__current, self.__targets)
+
+    def export_trains(self, indices):
+        # Поезда передаются вместе с вагонами и пассажирами; станции и линии - по имени и ключу,
+        # так как у получателя свои объекты сети
+        state = {
+            'train_ids': self.__train_ids[indices],
+            'numbers': [self.__trains[i].get_number() for i in indices],
+            'wagons': [self.__trains[i].get_wagons() for i in indices],
+            'current': [self.__stations[s].get_name() for s in self.__current[indices]],
+            'targets': [self.__stations[s].get_name() if s >= 0 else None for s in self.__targets[indices]],
+            'lines': [self.__line_keys[l] if l >= 0 else None for l in self.__line_ids[indices]],
+            'positions': self.__positions[indices],
+            'speeds': self.__speeds[indices],
+            'waiting': self.__waiting[indices],
+            'processed': self.__processed[indices],
+            'wait_timers': self.__wait_timers[indices],
+            'draws': self.__draws[indices],
+        }
+        keep = np.ones(len(self.__trains), dtype=bool)
+        keep[indices] = False
+        self.__reorder(np.flatnonzero(keep))
+        return state
+
+    def import_trains(self, state):
+        def station_id(name):
+            if name is None:
+                return -1
+            if name not in self.__station_names:
+                raise ValueError(f"Станция {name} неизвестна флоту")
+            return self.__station_names[name]
+
+        def line_id(key):
+            if key is None:
+                return -1
+            if key not in self.__line_index:
+                raise ValueError(f"Линия {key} неизвестна флоту")
+            return self.__line_index[key]
+
+        if set(state['train_ids'].tolist()) & set(self.__train_ids.tolist()):
+            raise ValueError("Поезд уже есть во флоте")
+        self.__train_ids = np.concatenate([self.__train_ids, state['train_ids']])
+        self.__current = np.concatenate([self.__current, np.array([station_id(s) for s in state['current']],
+                                                                  dtype=np.intp)])
+        self.__targets = np.concatenate([self.__targets, np.array([station_id(s) for s in state['targets']],
+                                                                  dtype=np.intp)])
+        self.__line_ids = np.concatenate([self.__line_ids, np.array([line_id(l) for l in state['lines']],
+                                                                    dtype=np.intp)])
+        self.__positions = np.concatenate([self.__positions, state['positions']])
+        self.__speeds = np.concatenate([self.__speeds, state['speeds']])
+        self.__waiting = np.concatenate([self.__waiting, state['waiting']])
+        self.__processed = np.concatenate([self.__processed, state['processed']])
+        self.__wait_timers = np.concatenate([self.__wait_timers, state['wait_timers']])
+        self.__draws = np.concatenate([self.__draws, state['draws']])
+        self.__trains.extend(FleetTrain(self, len(self.__trains) + i, number, wagons)
+                             for i, (number, wagons) in enumerate(zip(state['numbers'], state['wagons'])))
+        self.__reorder(np.argsort(self.__train_ids, kind='stable'))
+
+    def get_train(self, index):
+        return self.__trains[index]
+
+    def get_trains(self):
+        return self.__trains
+
+    def get_stations(self):
+        return self.__stations
+
 class Passenger:
     def __init__(self, destination, travel_date, preferences):
         self.__destination = destination
@@ -249,7 +556,8 @@ class Kassa:
     def sell_ticket(self, passenger, current_station):
         suitable_trains = [
             t for t in self.__trains
-            if t.get_current_station().get_name() == current_station.get_name()
+            if t.is_waiting()
+               and t.get_current_station().get_name() == current_station.get_name()
                and t.get_target_station() is not None
                and t.get_target_station().get_name() == passenger.get_destination()
         ]
@@ -284,6 +592,22 @@ class Kassa:
         self.__denied_count += 1
         return None
 
+    def process_arrival(self, train, station):
+        target_station = train.get_target_station()
+        if target_station is None:
+            return
+
+        for wagon in train.get_wagons():
+            if isinstance(wagon, PassengerWagon):
+                wagon.drop_passengers(target_station.get_name())
+
+        passengers = [p for p in station.get_passengers()
+                      if p.get_destination() == target_station.get_name()]
+
+        for passenger in passengers:
+            if self.sell_ticket(passenger, station):
+                station.remove_passenger(passenger)
+
     def __check_preferences(self, wagon, preferences):
         if 'type' in preferences:
             if preferences['type'].lower() != wagon.get_wagon_type().lower():
@@ -352,9 +676,548 @@ class Kassa:
 
         return by_train_ordered, by_station_ordered, by_wtype
 
+WAGON_TYPES = {
+    'SeatedWagon': SeatedWagon,
+    'PlatskartWagon': PlatskartWagon,
+    'CoupeWagon': CoupeWagon,
+    'ServiceWagon': ServiceWagon,
+}
+
+class Network:
+    def __init__(self):
+        self.__stations = []
+        self.__station_ids = {}
+        self.__lines = []
+        self.__trains = []
+        self.__train_ids = {}
+
+    def add_station(self, name, coordinates):
+        name = sys.intern(name)
+        if not name:
+            raise ValueError("Пустое название станции")
+        if name in self.__station_ids:
+            raise ValueError(f"Станция {name} уже существует")
+        station = Station(name, coordinates)
+        self.__station_ids[name] = len(self.__stations)
+        self.__stations.append(station)
+        return station
+
+    def add_line(self, start_name, end_name, direction='forward'):
+        if direction not in ('forward', 'backward'):
+            raise ValueError(f"Неизвестное направление линии: {direction}")
+        start_station = self.get_station(start_name)
+        end_station = self.get_station(end_name)
+        if start_station is end_station:
+            raise ValueError(f"Линия не может начинаться и заканчиваться на станции {start_name}")
+        line = Line(start_station, end_station, direction)
+        self.__lines.append(line)
+        return line
+
+    def add_train(self, number, station_name):
+        if number in self.__train_ids:
+            raise ValueError(f"Поезд {number} уже существует")
+        train = Train(number, self.get_station(station_name), self.__lines)
+        self.__train_ids[number] = len(self.__trains)
+        self.__trains.append(train)
+        return train
+
+    def get_station_id(self, name):
+        station_id = self.__station_ids.get(name)
+        if station_id is None:
+            raise ValueError(f"Неизвестная станция: {name}")
+        return station_id
+
+    def get_station(self, name):
+        return self.__stations[self.get_station_id(name)]
+
+    def get_train(self, number):
+        train_id = self.__train_ids.get(number)
+        if train_id is None:
+            raise ValueError(f"Неизвестный поезд: {number}")
+        return self.__trains[train_id]
+
+    def get_stations(self):
+        return self.__stations
+
+    def get_lines(self):
+        return self.__lines
+
+    def get_trains(self):
+        return self.__trains
+
+def _read_records(path):
+    # Записи читаются по одной, файл целиком в память не загружается
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+    elif path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f"{path}:{line_num}: некорректный JSON: {e}") from e
+                    yield line_num, record
+    else:
+        raise ValueError(f"Неподдерживаемый формат файла: {path}")
+
+def _field(record, key, default=None):
+    value = record.get(key)
+    if value is None or value == '':
+        if default is None:
+            raise ValueError(f"Отсутствует поле {key}")
+        return default
+    return value
+
+def _finite(record, key, default=None):
+    value = float(_field(record, key, default))
+    if not math.isfinite(value):
+        raise ValueError(f"Поле {key} должно быть конечным числом, получено {value}")
+    return value
+
+def _parse_options(value):
+    if isinstance(value, list):
+        return [str(option) for option in value]
+    return [option.strip() for option in (value or '').split(';') if option.strip()]
+
+def _make_wagon(record):
+    wagon_type = _field(record, 'type')
+    number = str(_field(record, 'number'))
+    if wagon_type not in WAGON_TYPES:
+        raise ValueError(f"Неизвестный тип вагона: {wagon_type}")
+    if wagon_type == 'ServiceWagon':
+        return ServiceWagon(number, _field(record, 'service_type', ''))
+
+    seats = int(_field(record, 'seats'))
+    price_per_km = _finite(record, 'price_per_km')
+    if seats <= 0 or price_per_km < 0:
+        raise ValueError(f"Некорректные места или цена вагона {number}")
+    options = _parse_options(record.get('options'))
+    if wagon_type == 'CoupeWagon':
+        bed_price = _finite(record, 'bed_price', 100)
+        if bed_price < 0:
+            raise ValueError(f"Некорректная цена постели вагона {number}")
+        return CoupeWagon(number, seats, price_per_km, bed_price, options)
+    return WAGON_TYPES[wagon_type](number, seats, price_per_km, options)
+
+def _load_records(path, handler):
+    for line_num, record in _read_records(path):
+        if not isinstance(record, dict):
+            raise ValueError(f"{path}:{line_num}: запись должна быть объектом, а не {type(record).__name__}")
+        try:
+            handler(record)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{path}:{line_num}: {e}") from e
+
+def load_network(stations_path, lines_path, trains_path, wagons_path=None):
+    network = Network()
+    _load_records(stations_path, lambda r: network.add_station(
+        str(_field(r, 'name')), (_finite(r, 'x'), _finite(r, 'y'))))
+    _load_records(lines_path, lambda r: network.add_line(
+        str(_field(r, 'start')), str(_field(r, 'end')), _field(r, 'direction', 'forward')))
+    _load_records(trains_path, lambda r: network.add_train(str(_field(r, 'number')), str(_field(r, 'station'))))
+    if wagons_path:
+        _load_records(wagons_path, lambda r: network.get_train(str(_field(r, 'train'))).add_wagon(_make_wagon(r)))
+    return network
+
+def save_network(network, directory):
+    os.makedirs(directory, exist_ok=True)
+
+    def write(name, fields, rows):
+        with open(os.path.join(directory, name), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            writer.writerows(rows)
+
+    write('stations.csv', ['name', 'x', 'y'],
+          ((s.get_name(), *s.get_coordinates()) for s in network.get_stations()))
+    write('lines.csv', ['start', 'end', 'direction'],
+          ((l.get_start_station().get_name(), l.get_end_station().get_name(), l.get_direction())
+           for l in network.get_lines()))
+    write('trains.csv', ['number', 'station'],
+          ((t.get_number(), t.get_current_station().get_name()) for t in network.get_trains()))
+
+    def wagon_rows():
+        for train in network.get_trains():
+            for wagon in train.get_wagons():
+                row = [train.get_number(), type(wagon).__name__, wagon.get_number(), '', '', '', '', '']
+                if isinstance(wagon, ServiceWagon):
+                    row[6] = wagon.get_service_type()
+                else:
+                    row[3:6] = [wagon.get_seats(), wagon.get_price_per_km(),
+                                wagon.get_bed_price() if isinstance(wagon, CoupeWagon) else '']
+                    row[7] = ';'.join(wagon.get_options())
+                yield row
+
+    write('wagons.csv', ['train', 'type', 'number', 'seats', 'price_per_km', 'bed_price', 'service_type', 'options'],
+          wagon_rows())
+
+def _nearest_stations(coordinates, neighbors):
+    # Соседи ищутся по сетке ячеек, а не перебором всех пар станций
+    cell = max(max(abs(c) for xy in coordinates for c in xy), 1.0) / max(1, int(math.sqrt(len(coordinates))))
+    grid = {}
+    for i, (x, y) in enumerate(coordinates):
+        grid.setdefault((int(x // cell), int(y // cell)), []).append(i)
+    max_ring = max(max(abs(cx), abs(cy)) for cx, cy in grid) * 2 + 1
+
+    for i, (x, y) in enumerate(coordinates):
+        cx, cy = int(x // cell), int(y // cell)
+        found = []
+        for ring in range(max_ring + 1):
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in range(cy - ring, cy + ring + 1):
+                    if max(abs(gx - cx), abs(gy - cy)) != ring:
+                        continue
+                    for j in grid.get((gx, gy), ()):
+                        if j != i:
+                            found.append(((coordinates[j][0] - x) ** 2 + (coordinates[j][1] - y) ** 2, j))
+            if len(found) >= neighbors:
+                nearest = heapq.nsmallest(neighbors, found)
+                if nearest[-1][0] <= (ring * cell) ** 2:
+                    break
+        yield i, [j for _, j in heapq.nsmallest(neighbors, found)]
+
+def generate_network(station_count=10000, train_count=None, seed=0, neighbors=3, size=10000.0):
+    if station_count < 1:
+        raise ValueError("Сеть должна содержать хотя бы одну станцию")
+    rng = random.Random(seed)
+    network = Network()
+
+    # Станции группируются вокруг городов, как в реальной сети
+    centers = [(rng.uniform(0, size), rng.uniform(0, size)) for _ in range(max(1, station_count // 50))]
+    spread = size / math.sqrt(len(centers)) / 4
+    coordinates = []
+    for i in range(station_count):
+        cx, cy = rng.choice(centers)
+        coordinates.append((round(min(max(rng.gauss(cx, spread), 0), size), 1),
+                            round(min(max(rng.gauss(cy, spread), 0), size), 1)))
+        network.add_station(f"Станция {i + 1:05d}", coordinates[-1])
+    names = [s.get_name() for s in network.get_stations()]
+
+    edges = set()
+    for i, nearest in _nearest_stations(coordinates, neighbors):
+        for j in nearest:
+            edges.add((min(i, j), max(i, j)))
+
+    parent = list(range(station_count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in edges:
+        parent[find(i)] = find(j)
+    roots = sorted({find(i) for i in range(station_count)}, key=lambda i: coordinates[i])
+    for i, j in zip(roots, roots[1:]):
+        edges.add((min(i, j), max(i, j)))
+
+    for i, j in sorted(edges):
+        network.add_line(names[i], names[j], 'forward')
+        network.add_line(names[j], names[i], 'backward')
+
+    if train_count is None:
+        train_count = max(1, station_count // 4)
+    for number in range(1, train_count + 1):
+        train = network.add_train(f"{number:03d}", rng.choice(names))
+        for w in range(1, rng.randint(6, 14) + 1):
+            options = rng.sample(['телевизор', 'телефон'], rng.randint(0, 2))
+            wagon_type = rng.choices(['PlatskartWagon', 'CoupeWagon', 'SeatedWagon'], weights=[5, 3, 2])[0]
+            if wagon_type == 'PlatskartWagon':
+                train.add_wagon(PlatskartWagon(f"W{w}", 54, round(rng.uniform(1.5, 2.0), 2), options))
+            elif wagon_type == 'CoupeWagon':
+                train.add_wagon(CoupeWagon(f"W{w}", 36, round(rng.uniform(2.5, 3.5), 2), 150, options))
+            else:
+                train.add_wagon(SeatedWagon(f"W{w}", 60, round(rng.uniform(1.8, 2.4), 2), options))
+        if rng.random() > 0.5:
+            train.add_wagon(ServiceWagon("S1", "ресторан"))
+    return network
+
+def generate_passengers(station, destinations, current_time, rng=random):
+    if len(destinations) < 2:
+        return
+    for _ in range(rng.randint(5, 10)):
+        dest = destinations[rng.randrange(len(destinations) - 1)]
+        if dest == station.get_name():
+            dest = destinations[-1]
+        prefs = {
+            'type': rng.choice(['сидячий', 'плацкарт', 'купе']),
+            'options': rng.sample(['телевизор', 'телефон'], rng.randint(0, 2))
+        }
+        if rng.random() > 0.7:
+            prefs['постель'] = True
+        station.add_passenger(Passenger(dest, current_time.strftime("%Y-%m-%d"), prefs))
+
+def partition_stations(stations, regions):
+    # Полосы по координате x: соседние станции чаще попадают в один регион
+    order = sorted(range(len(stations)), key=lambda i: stations[i].get_coordinates())
+    region_of = [0] * len(stations)
+    for rank, i in enumerate(order):
+        region_of[i] = rank * regions // len(stations)
+    return region_of
+
+class RegionSimulation:
+    # Регион хранит только свои станции, линии, которые их касаются, и поезда, которые сейчас ему принадлежат
+    def __init__(self, region, shard, seed=0, step=0.01, scale=1.0, wait_ticks=20, generation_ticks=240,
+                 start_time=datetime.datetime(2024, 1, 1, 8, 0)):
+        if generation_ticks < 1:
+            raise ValueError("Интервал генерации пассажиров должен быть не меньше одного тика")
+        self.__region = region
+        self.__stations = shard['stations']
+        self.__destinations = shard['destinations']
+        self.__fleet = Fleet([], shard['lines'], step, wait_ticks, seed, shard['line_keys'], self.__stations)
+        self.__scale = scale
+        self.__generation_ticks = generation_ticks
+        self.__start_time = start_time
+        self.__tick = 0
+        self.__tickets = []
+
+        self.__region_of = np.array([shard['region_of'][s.get_name()] for s in self.__fleet.get_stations()],
+                                    dtype=np.intp)
+        self.__rngs = [random.Random(f"{seed}:{s.get_name()}") for s in self.__stations]
+        self.__kassa = Kassa(self.__fleet.get_trains())
+        self.__fleet.import_trains(shard['trains'])
+
+    def get_region(self):
+        return self.__region
+
+    def get_kassa(self):
+        return self.__kassa
+
+    def export_trains(self):
+        handoffs = {}
+        while True:
+            owners = self.__region_of[self.__fleet.get_owner_stations()]
+            leaving = np.flatnonzero(owners != self.__region)
+            if leaving.size == 0:
+                return handoffs
+            target = int(owners[leaving[0]])
+            handoffs[target] = self.__fleet.export_trains(leaving[owners[leaving] == target])
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            if self.__tick % self.__generation_ticks == 0:
+                current_time = self.__start_time + datetime.timedelta(minutes=self.__tick)
+                for station, rng in zip(self.__stations, self.__rngs):
+                    generate_passengers(station, self.__destinations, current_time, rng)
+
+            for index in self.__fleet.advance(self.__scale):
+                train = self.__fleet.get_train(index)
+                sold = len(self.__kassa.get_sales_log())
+                self.__kassa.process_arrival(train, train.get_current_station())
+                train.process_passengers()
+                for seq, ticket in enumerate(self.__kassa.get_sales_log()[sold:]):
+                    self.__tickets.append((self.__tick, self.__fleet.get_train_id(index), seq,
+                                           ticket.get_train().get_number(),
+                                           ticket.get_departure_station().get_name(),
+                                           ticket.get_wagon().get_wagon_type(), ticket.get_price()))
+            self.__tick += 1
+
+    def receive(self, incoming):
+        for state in incoming:
+            self.__fleet.import_trains(state)
+
+    def run_epoch(self, ticks, incoming):
+        self.receive(incoming)
+        self.run(ticks)
+        return self.export_trains()
+
+    def get_stats(self):
+        return {
+            'tickets': self.__tickets,
+            'denied': self.__kassa.get_denied_requests(),
+            'wagon_load': self.__kassa.get_wagon_load_stats(),
+            'route_load': self.__kassa.get_route_load_stats(),
+            'stations': {s.get_name(): (s.get_passenger_count(), s.get_total_departed()) for s in self.__stations},
+            'trains': {t.get_number(): (t.get_current_station().get_name(),
+                                        t.get_target_station().get_name() if t.get_target_station() else None,
+                                        t.get_position(), t.get_total_passengers()) for t in self.__fleet.get_trains()},
+        }
+
+def merge_region_stats(shards):
+    tickets = sorted(t for shard in shards for t in shard['tickets'])
+    by_train, by_station, by_wtype = {}, {}, {}
+    for _, _, _, tnum, st, wagon_type, price in tickets:
+        by_train[tnum] = by_train.get(tnum, 0) + price
+        by_station[st] = by_station.get(st, 0) + price
+        by_wtype[wagon_type] = by_wtype.get(wagon_type, 0) + price
+
+    wagon_load = {}
+    route_load = {}
+    for shard in shards:
+        for key, data in shard['wagon_load'].items():
+            wagon_load.setdefault(key, [0, 0])
+            wagon_load[key][0] += data[0]
+            wagon_load[key][1] += data[1]
+        for key, data in shard['route_load'].items():
+            route_load.setdefault(key, [0, 0])
+            route_load[key][0] += data[0]
+            route_load[key][1] += data[1]
+
+    stations = {}
+    trains = {}
+    for shard in shards:
+        stations.update(shard['stations'])
+        trains.update(shard['trains'])
+
+    return {
+        'revenue': ({k: by_train[k] for k in sorted(by_train, key=lambda x: int(x))},
+                    {k: by_station[k] for k in sorted(by_station)},
+                    {k: by_wtype[k] for k in sorted(by_wtype)}),
+        'tickets_sold': len(tickets),
+        'denied': sum(shard['denied'] for shard in shards),
+        'wagon_load': {k: wagon_load[k] for k in sorted(wagon_load)},
+        'route_load': {k: route_load[k] for k in sorted(route_load)},
+        'stations': {k: stations[k] for k in sorted(stations)},
+        'trains': {k: trains[k] for k in sorted(trains)},
+    }
+
+def _region_worker(region, shard, options, commands, results):
+    try:
+        simulation = RegionSimulation(region, shard, **options)
+        while True:
+            command, args = commands.get()
+            if command == 'stop':
+                break
+            results.put(('ok', getattr(simulation, command)(*args)))
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+
+class ShardedSimulation:
+    def __init__(self, stations, lines, trains, regions=2, epoch_ticks=50, processes=True,
+                 region_of=None, **options):
+        step = options.get('step', 0.01) * options.get('scale', 1.0)
+        if epoch_ticks * step >= 1.0:
+            raise ValueError("Эпоха длиннее минимального времени в пути: поезд прибудет до передачи региону")
+        if regions < 1:
+            raise ValueError("Число регионов должно быть не меньше 1")
+        if region_of is None:
+            region_of = partition_stations(stations, regions)
+        if len(region_of) != len(stations):
+            raise ValueError(f"Регионы заданы для {len(region_of)} станций из {len(stations)}")
+        for station, region in zip(stations, region_of):
+            if not 0 <= region < regions:
+                raise ValueError(f"Станция {station.get_name()}: регион {region} вне диапазона 0..{regions - 1}")
+        self.__regions = regions
+        self.__epoch_ticks = epoch_ticks
+        self.__region_of = list(region_of)
+        self.__pending = [[] for _ in range(regions)]
+        self.__workers = []
+        self.__channels = []
+        self.__shards = []
+        shards = self.__split_network(stations, lines, trains, options)
+
+        if processes:
+            for region in range(regions):
+                commands, results = multiprocessing.Queue(), multiprocessing.Queue()
+                worker = multiprocessing.Process(target=_region_worker, daemon=True,
+                                                 args=(region, shards[region], options, commands, results))
+                worker.start()
+                self.__workers.append(worker)
+                self.__channels.append((commands, results))
+        else:
+            self.__shards = [RegionSimulation(region, copy.deepcopy(shards[region]), **options)
+                             for region in range(regions)]
+
+    def __split_network(self, stations, lines, trains, options):
+        region_by_station = dict(zip(stations, self.__region_of))
+        # Имена всех станций нужны каждому региону для выбора пункта назначения пассажира
+        destinations = [s.get_name() for s in stations]
+        shards = [{'stations': [], 'lines': [], 'line_keys': [], 'region_of': {}, 'destinations': destinations}
+                  for _ in range(self.__regions)]
+        for station, region in region_by_station.items():
+            shards[region]['stations'].append(station)
+            shards[region]['region_of'][station.get_name()] = region
+
+        for key, line in enumerate(lines):
+            ends = (line.get_start_station(), line.get_end_station())
+            if any(s not in region_by_station for s in ends):
+                raise ValueError(f"Линия {ends[0].get_name()} - {ends[1].get_name()} ведет к станции вне сети")
+            for region in {region_by_station[s] for s in ends}:
+                shards[region]['lines'].append(line)
+                shards[region]['line_keys'].append(key)
+                for s in ends:
+                    shards[region]['region_of'][s.get_name()] = region_by_station[s]
+
+        for train in trains:
+            if train.get_current_station() not in region_by_station:
+                raise ValueError(f"Поезд {train.get_number()} стоит на станции вне сети")
+        fleet = Fleet(trains, lines, options.get('step', 0.01), options.get('wait_ticks', 20), 0)
+        owners = np.array([region_by_station[s] for s in fleet.get_stations()], dtype=np.intp)
+        owners = owners[fleet.get_owner_stations()]
+        for region in range(self.__regions):
+            shards[region]['trains'] = fleet.export_trains(np.flatnonzero(owners == region))
+            owners = owners[owners != region]
+        return shards
+
+    def __call_all(self, command, args_by_region):
+        if not self.__workers and not self.__shards:
+            raise RuntimeError("Симуляция уже остановлена")
+        if not self.__workers:
+            return [getattr(shard, command)(*args) for shard, args in zip(self.__shards, args_by_region)]
+        for (commands, _), args in zip(self.__channels, args_by_region):
+            commands.put((command, args))
+        return [self.__receive(region) for region in range(self.__regions)]
+
+    def __receive(self, region):
+        _, results = self.__channels[region]
+        worker = self.__workers[region]
+        while True:
+            try:
+                status, value = results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                # Ответ мог быть отправлен прямо перед завершением процесса
+                if not worker.is_alive() and results.empty():
+                    raise RuntimeError(f"Процесс региона {region} завершился с кодом {worker.exitcode}")
+        if status == 'error':
+            raise RuntimeError(f"Ошибка в процессе региона {region}:\n{value}")
+        return value
+
+    def run(self, epochs):
+        for _ in range(epochs):
+            args = [(self.__epoch_ticks, self.__pending[r]) for r in range(self.__regions)]
+            self.__pending = [[] for _ in range(self.__regions)]
+            for handoffs in self.__call_all('run_epoch', args):
+                for target, handoff in handoffs.items():
+                    self.__pending[target].append(handoff)
+
+    def get_stats(self):
+        # Поезда, ожидающие передачи, сначала доставляются в свои регионы
+        self.__call_all('receive', [(pending,) for pending in self.__pending])
+        self.__pending = [[] for _ in range(self.__regions)]
+        return merge_region_stats(self.__call_all('get_stats', [() for _ in range(self.__regions)]))
+
+    def close(self):
+        for (commands, _), worker in zip(self.__channels, self.__workers):
+            if worker.is_alive():
+                commands.put(('stop', ()))
+        for worker in self.__workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self.__workers = []
+        self.__channels = []
+        self.__shards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
 class RailwayApp:
-    def __init__(self, root, kassa, stations, lines):
+    def __init__(self, root, kassa, stations, lines, fleet=None):
+        # Касса должна работать с представлениями флота, иначе карта и продажи увидят застывшие поезда
+        if fleet is not None and kassa.get_trains() is not fleet.get_trains():
+            raise ValueError("Касса должна быть построена по поездам флота: Kassa(fleet.get_trains())")
         self.__kassa = kassa
+        self.__fleet = fleet
         self.__stations = stations
         self.__lines = lines
         self.root = root
@@ -407,7 +1270,7 @@ class RailwayApp:
         self.__station_coords = {}
         center_x, center_y = 650, 350
         radius = 280
-        angles = [math.radians(90 + i * 60) for i in range(6)]
+        angles = [math.radians(90 + i * 360 / len(self.__stations)) for i in range(len(self.__stations))]
 
         for i, station in enumerate(self.__stations):
             x = center_x + radius * math.cos(angles[i])
@@ -418,10 +1281,14 @@ class RailwayApp:
             self.canvas.create_text(x, y + 70, text=f"Пассажиров: {station.get_passenger_count()}",
                                     font=('Arial', 9), tags=f"pass_{station.get_name()}")
 
+        connections = {(line.get_start_station(), line.get_end_station()) for line in self.__lines}
         for line in self.__lines:
             x1, y1 = self.__station_coords[line.get_start_station()]
             x2, y2 = self.__station_coords[line.get_end_station()]
-            arrow = tk.LAST if line.get_direction() == 'forward' else tk.FIRST
+            if (line.get_end_station(), line.get_start_station()) in connections:
+                arrow = tk.BOTH
+            else:
+                arrow = tk.LAST if line.get_direction() == 'forward' else tk.FIRST
             self.canvas.create_line(x1, y1, x2, y2, arrow=arrow, width=3, fill="#555")
 
     def __update_trains(self):
@@ -512,18 +1379,7 @@ class RailwayApp:
     def __generate_passengers(self):
         if self.__generation_running:
             for station in self.__stations:
-                for _ in range(random.randint(5, 10)):
-                    destinations = [s for s in self.__stations if s != station]
-                    if destinations:
-                        dest = random.choice(destinations)
-                        prefs = {
-                            'type': random.choice(['сидячий', 'плацкарт', 'купе']),
-                            'options': random.sample(['телевизор', 'телефон'], random.randint(0, 2))
-                        }
-                        if random.random() > 0.7:
-                            prefs['постель'] = True
-                        passenger = Passenger(dest.get_name(), self.__current_time.strftime("%Y-%m-%d"), prefs)
-                        station.add_passenger(passenger)
+                generate_passengers(station, [s.get_name() for s in self.__stations], self.__current_time)
 
             self.root.after(int(12000 // self.__simulation_speed), self.__generate_passengers)
 
@@ -537,14 +1393,20 @@ class RailwayApp:
             self.__current_time += datetime.timedelta(minutes=1)
             self.time_label.config(text=f"Время: {self.__current_time.strftime('%H:%M')}")
 
-            for train in self.__kassa.get_trains():
-                if train.needs_processing():
-                    self.__handle_arrival(train)
+            if self.__fleet is not None:
+                for index in self.__fleet.advance(self.__simulation_speed):
+                    train = self.__fleet.get_train(index)
+                    self.__process_passengers(train, train.get_current_station())
                     train.process_passengers()
+            else:
+                for train in self.__kassa.get_trains():
+                    if train.needs_processing():
+                        self.__handle_arrival(train)
+                        train.process_passengers()
 
-            for train in self.__kassa.get_trains():
-                if not train.is_waiting():
-                    train.move(0.01 * self.__simulation_speed)
+                for train in self.__kassa.get_trains():
+                    if not train.is_waiting():
+                        train.move(0.01 * self.__simulation_speed)
 
             self.__update_trains()
 
@@ -560,28 +1422,7 @@ class RailwayApp:
         self.__update_trains()
 
     def __process_passengers(self, train, station):
-        passengers_to_remove = []
-        target_station = train.get_target_station()
-        if target_station is None:
-            return
-
-        for wagon in train.get_wagons():
-            if isinstance(wagon, PassengerWagon):
-                wagon._PassengerWagon__passengers = [
-                    p for p in wagon._PassengerWagon__passengers
-                    if p.get_destination() != target_station.get_name()
-                ]
-
-        passengers = [p for p in station.get_passengers()
-                      if p.get_destination() == target_station.get_name()]
-
-        for passenger in passengers:
-            ticket = self.__kassa.sell_ticket(passenger, station)
-            if ticket:
-                passengers_to_remove.append(passenger)
-
-        for p in passengers_to_remove:
-            station.remove_passenger(p)
+        self.__kassa.process_arrival(train, station)
 
     def __start_simulation(self):
         if not self.__simulation_running:
@@ -672,36 +1513,15 @@ class RailwayApp:
             ttk.Label(frame, text=f"{station.get_name()}: Ожидает {station.get_passenger_count()}, "
                                   f"Отправлено {station.get_total_departed()}").pack(anchor=tk.W)
 
-stations = [
-    Station("Москва", (0, 0)),
-    Station("Санкт-Петербург", (100, 0)),
-    Station("Казань", (0, 100)),
-    Station("Сочи", (100, 100)),
-    Station("Владивосток", (50, 50)),
-    Station("Екатеринбург", (150, 50))
-]
-
-lines = []
-for s1 in stations:
-    for s2 in stations:
-        if s1 != s2:
-            lines.append(Line(s1, s2, 'forward'))
-            lines.append(Line(s2, s1, 'backward'))
-
-trains = [
-    Train("001", stations[0], lines),
-    Train("002", stations[1], lines),
-    Train("003", stations[2], lines),
-    Train("004", stations[3], lines),
-    Train("005", stations[4], lines)
-]
-
-for train in trains:
-    train.add_wagon(SeatedWagon("W1", 50, 2.0, ["телевизор"]))
-    train.add_wagon(PlatskartWagon("W2", 40, 1.8, ["телефон"]))
-    train.add_wagon(CoupeWagon("W3", 30, 3.0, 150))
-    train.add_wagon(ServiceWagon("S1", "ресторан"))
-
-root = tk.Tk()
-app = RailwayApp(root, Kassa(trains), stations, lines)
-root.mainloop()
+if __name__ == "__main__":
+    network = load_network("Data/stations.csv", "Data/lines.csv", "Data/trains.csv", "Data/wagons.csv")
+
+    trains = network.get_trains()
+    fleet = None
+    if "--fleet" in sys.argv[1:]:
+        fleet = Fleet(trains, network.get_lines())
+        trains = fleet.get_trains()
+
+    root = tk.Tk()
+    app = RailwayApp(root, Kassa(trains), network.get_stations(), network.get_lines(), fleet)
+    root.mainloop()
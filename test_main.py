@@ -0,0 +1,309 @@
+import json
+import math
+import random
+import re
+
+import pytest
+
+from main import (Station, Line, Train, SeatedWagon, PlatskartWagon, CoupeWagon, ServiceWagon,
+                  Fleet, Kassa, RailwayApp, ShardedSimulation, load_network, save_network, generate_network,
+                  _nearest_stations)
+
+
+def build_network(station_count=30, train_count=90):
+    stations = [Station(f"S{i:02d}", ((i * 37) % 101, (i * 53) % 97)) for i in range(station_count)]
+    lines = []
+    for i in range(station_count):
+        for step in (1, 5):
+            lines.append(Line(stations[i], stations[(i + step) % station_count], 'forward'))
+            lines.append(Line(stations[(i + step) % station_count], stations[i], 'backward'))
+    trains = [Train(f"{i + 1:03d}", stations[i % station_count], lines) for i in range(train_count)]
+    for train in trains:
+        train.add_wagon(SeatedWagon("W1", 50, 2.0, ["телевизор"]))
+        train.add_wagon(PlatskartWagon("W2", 40, 1.8, ["телефон"]))
+        train.add_wagon(CoupeWagon("W3", 30, 3.0, 150))
+        train.add_wagon(ServiceWagon("S1", "ресторан"))
+    return stations, lines, trains
+
+
+def build_shuttle():
+    a, b, c = Station("A", (0, 0)), Station("B", (10, 0)), Station("C", (20, 0))
+    lines = [Line(a, b, 'forward'), Line(b, a, 'backward'), Line(a, c, 'forward')]
+    return (a, b, c), lines
+
+
+def snapshot(train):
+    target = train.get_target_station()
+    return (train.get_number(), train.get_current_station().get_name(), target.get_name() if target else None,
+            train.get_position(), train.is_waiting(), train.needs_processing(), train.get_current_line())
+
+
+def test_fleet_advance_returns_arriving_indices():
+    (a, b, _), lines = build_shuttle()
+    fleet = Fleet([Train("1", b, lines), Train("2", b, lines), Train("3", b, lines)], lines, wait_ticks=100)
+    for index, speed in enumerate([0.5, 0.25, 1.0]):
+        fleet.set_speed(index, speed)
+
+    assert fleet.advance().tolist() == [2]
+    assert fleet.advance().tolist() == [0]
+    assert fleet.advance().tolist() == []
+    assert fleet.advance().tolist() == [1]
+    assert all(t.get_current_station() is a and t.is_waiting() for t in fleet.get_trains())
+
+
+def test_fleet_train_without_outgoing_lines_stays_put():
+    (_, _, c), lines = build_shuttle()
+    fleet = Fleet([Train("1", c, lines)], lines)
+    for _ in range(50):
+        assert fleet.advance().size == 0
+    train = fleet.get_train(0)
+    assert train.get_current_station() is c
+    assert train.get_target_station() is None
+    assert train.get_current_line() is None
+    assert train.get_position() == 0.0
+
+
+def test_fleet_wait_timer_starts_after_processing():
+    (a, b, _), lines = build_shuttle()
+    fleet = Fleet([Train("1", b, lines)], lines, wait_ticks=3)
+    fleet.set_speed(0, 1.0)
+    fleet.advance()
+    train = fleet.get_train(0)
+    assert train.get_current_station() is a and train.needs_processing()
+
+    for _ in range(20):
+        fleet.advance()
+    assert train.is_waiting() and train.needs_processing()
+
+    train.process_passengers()
+    for _ in range(3):
+        fleet.advance()
+        assert train.is_waiting()
+    assert fleet.advance().tolist() == [0]
+    assert train.get_current_station() is not a
+
+
+def test_fleet_export_import_round_trip():
+    stations, lines = build_shuttle()
+    trains = [Train(str(n), stations[n % 2], lines) for n in range(1, 6)]
+    source = Fleet(trains, lines, wait_ticks=5, seed=3)
+    for _ in range(37):
+        for index in source.advance():
+            if index % 2:
+                source.process_passengers(index)
+    before = [snapshot(t) for t in source.get_trains()]
+    wagons = [t.get_wagons() for t in source.get_trains()]
+
+    state = source.export_trains([3, 1])
+    assert [t.get_number() for t in source.get_trains()] == ["1", "3", "5"]
+    target = Fleet([], lines, wait_ticks=5, seed=3)
+    target.import_trains(state)
+    assert [snapshot(t) for t in target.get_trains()] == [before[1], before[3]]
+
+    source.import_trains(target.export_trains([0, 1]))
+    assert [snapshot(t) for t in source.get_trains()] == before
+    assert [t.get_wagons() for t in source.get_trains()] == wagons
+
+
+def test_fleet_train_getters_match_state():
+    stations, lines = build_shuttle()
+    fleet = Fleet([Train(str(n), stations[n % 3], lines) for n in range(6)], lines, seed=1)
+    for _ in range(120):
+        fleet.advance()
+    views = [snapshot(t) for t in fleet.get_trains()]
+    state = fleet.export_trains(list(range(6)))
+
+    assert [v[0] for v in views] == state['numbers']
+    assert [v[1] for v in views] == state['current']
+    assert [v[2] for v in views] == state['targets']
+    assert [v[3] for v in views] == state['positions'].tolist()
+    assert [v[4] for v in views] == state['waiting'].tolist()
+    assert [v[5] for v in views] == (state['waiting'] & ~state['processed']).tolist()
+    assert [lines.index(v[6]) if v[6] else None for v in views] == state['lines']
+
+
+def test_railway_app_requires_kassa_over_fleet_trains():
+    stations, lines = build_shuttle()
+    trains = [Train("1", stations[0], lines)]
+    with pytest.raises(ValueError):
+        RailwayApp(None, Kassa(trains), list(stations), lines, Fleet(trains, lines))
+
+
+def run_stats(regions, processes, epochs=20, seed=7):
+    with ShardedSimulation(*build_network(), regions=regions, processes=processes, seed=seed) as simulation:
+        simulation.run(epochs)
+        return simulation.get_stats()
+
+
+@pytest.fixture(scope="module")
+def single_process_stats():
+    return run_stats(regions=1, processes=False)
+
+
+def test_single_process_run_sells_tickets(single_process_stats):
+    assert single_process_stats['tickets_sold'] > 0
+    assert len(single_process_stats['trains']) == 90
+
+
+@pytest.mark.parametrize("regions", [2, 3])
+def test_in_process_shards_match_single_process(single_process_stats, regions):
+    assert run_stats(regions=regions, processes=False) == single_process_stats
+
+
+def test_worker_processes_match_single_process(single_process_stats):
+    assert run_stats(regions=3, processes=True) == single_process_stats
+
+
+def test_worker_error_is_raised_in_parent():
+    with ShardedSimulation(*build_network(), regions=2, processes=True, generation_ticks=0) as simulation:
+        with pytest.raises(RuntimeError, match="ValueError: Интервал генерации пассажиров"):
+            simulation.run(1)
+
+
+@pytest.mark.parametrize("region_of", [[], [0] * 29 + [2], [-1] * 30])
+def test_invalid_region_assignment_is_rejected(region_of):
+    with pytest.raises(ValueError):
+        ShardedSimulation(*build_network(), regions=2, processes=False, region_of=region_of)
+
+
+VALID_FILES = {
+    'stations.csv': "name,x,y\nA,0,0\nB,10,0\n",
+    'lines.csv': "start,end,direction\nA,B,forward\nB,A,backward\n",
+    'trains.csv': "number,station\n1,A\n",
+    'wagons.csv': "train,type,number,seats,price_per_km,bed_price,service_type,options\n"
+                  "1,CoupeWagon,W1,36,3.0,150,,телефон\n",
+}
+
+
+def write_network(tmp_path, **overrides):
+    files = dict(VALID_FILES, **overrides)
+    paths = {}
+    for name, content in files.items():
+        path = tmp_path / name
+        path.write_text(content, encoding='utf-8')
+        paths[name.split('.')[0]] = str(path)
+    return paths
+
+
+def load_paths(paths):
+    return load_network(paths['stations'], paths['lines'], paths['trains'], paths['wagons'])
+
+
+@pytest.mark.parametrize("name, content, line, message", [
+    ('stations.csv', "name,x,y\nA,0,0\nB,,0\n", 3, "Отсутствует поле x"),
+    ('stations.csv', "name,x,y\nA,0,0\nA,10,0\n", 3, "Станция A уже существует"),
+    ('stations.csv', "name,x,y\nA,0,0\nB,nan,inf\n", 3, "Поле x должно быть конечным числом"),
+    ('lines.csv', "start,end,direction\nA,Z,forward\n", 2, "Неизвестная станция: Z"),
+    ('lines.csv', "start,end,direction\nA,A,forward\n", 2, "Линия не может начинаться и заканчиваться"),
+    ('lines.csv', "start,end,direction\nA,B,sideways\n", 2, "Неизвестное направление линии: sideways"),
+    ('trains.csv', "number,station\n1,A\n1,B\n", 3, "Поезд 1 уже существует"),
+    ('trains.csv', "number,station\n1,Z\n", 2, "Неизвестная станция: Z"),
+    ('wagons.csv', "train,type,number,seats,price_per_km\n7,SeatedWagon,W1,50,2.0\n", 2, "Неизвестный поезд: 7"),
+    ('wagons.csv', "train,type,number,seats,price_per_km\n1,SleeperWagon,W1,50,2.0\n", 2,
+     "Неизвестный тип вагона: SleeperWagon"),
+    ('wagons.csv', "train,type,number,seats,price_per_km\n1,SeatedWagon,W1,0,2.0\n", 2,
+     "Некорректные места или цена вагона W1"),
+    ('wagons.csv', "train,type,number,seats,price_per_km\n1,SeatedWagon,W1,many,2.0\n", 2, "invalid literal"),
+    ('wagons.csv', "train,type,number,seats,price_per_km\n1,SeatedWagon,W1,50,-1\n", 2,
+     "Некорректные места или цена вагона W1"),
+    ('wagons.csv', "train,type,number,seats,price_per_km\n1,SeatedWagon,W1,50,inf\n", 2,
+     "Поле price_per_km должно быть конечным числом"),
+    ('wagons.csv', "train,type,number,seats,price_per_km,bed_price\n1,CoupeWagon,W1,36,3.0,nan\n", 2,
+     "Поле bed_price должно быть конечным числом"),
+])
+def test_load_network_reports_file_and_line(tmp_path, name, content, line, message):
+    paths = write_network(tmp_path, **{name: content})
+    path = str(tmp_path / name)
+    with pytest.raises(ValueError, match=re.escape(f"{path}:{line}: {message}")):
+        load_paths(paths)
+
+
+def test_load_network_rejects_non_object_json_lines_record(tmp_path):
+    path = tmp_path / 'stations.jsonl'
+    path.write_text('{"name": "A", "x": 0, "y": 0}\n["B", 10, 0]\n', encoding='utf-8')
+    paths = write_network(tmp_path)
+    with pytest.raises(ValueError, match=re.escape(f"{path}:2: запись должна быть объектом")):
+        load_network(str(path), paths['lines'], paths['trains'])
+
+
+def test_load_network_rejects_broken_json_lines(tmp_path):
+    path = tmp_path / 'stations.jsonl'
+    path.write_text('{"name": "A", "x": 0, "y": 0}\n\n{"name": "B",\n', encoding='utf-8')
+    paths = write_network(tmp_path)
+    with pytest.raises(ValueError, match=re.escape(f"{path}:3: некорректный JSON")):
+        load_network(str(path), paths['lines'], paths['trains'])
+
+
+def test_load_network_rejects_unsupported_extension(tmp_path):
+    path = tmp_path / 'stations.json'
+    path.write_text('[]', encoding='utf-8')
+    paths = write_network(tmp_path)
+    with pytest.raises(ValueError, match=re.escape(f"Неподдерживаемый формат файла: {path}")):
+        load_network(str(path), paths['lines'], paths['trains'])
+
+
+def test_load_network_accepts_numeric_station_references(tmp_path):
+    files = {
+        'stations': [{"name": 5, "x": 0, "y": 0}, {"name": 6, "x": 1, "y": 0}],
+        'lines': [{"start": 5, "end": 6}],
+        'trains': [{"number": 1, "station": 5}],
+    }
+    paths = []
+    for name, records in files.items():
+        path = tmp_path / f"{name}.jsonl"
+        path.write_text(''.join(json.dumps(r) + '\n' for r in records), encoding='utf-8')
+        paths.append(str(path))
+    network = load_network(*paths)
+    assert network.get_train("1").get_current_station() is network.get_station("5")
+    assert network.get_lines()[0].get_end_station() is network.get_station("6")
+
+
+def describe_network(network):
+    def wagon(w):
+        if isinstance(w, ServiceWagon):
+            return type(w).__name__, w.get_number(), w.get_service_type()
+        bed = w.get_bed_price() if isinstance(w, CoupeWagon) else None
+        return type(w).__name__, w.get_number(), w.get_seats(), w.get_price_per_km(), bed, w.get_options()
+
+    return (
+        [(s.get_name(), tuple(s.get_coordinates())) for s in network.get_stations()],
+        [(l.get_start_station().get_name(), l.get_end_station().get_name(), l.get_direction())
+         for l in network.get_lines()],
+        [(t.get_number(), t.get_current_station().get_name(), [wagon(w) for w in t.get_wagons()])
+         for t in network.get_trains()],
+    )
+
+
+@pytest.mark.parametrize("station_count, seed", [(1, 0), (120, 4), (700, 11)])
+def test_generated_network_survives_save_and_load(tmp_path, station_count, seed):
+    network = generate_network(station_count, train_count=25, seed=seed)
+    save_network(network, str(tmp_path))
+    loaded = load_network(*(str(tmp_path / f"{name}.csv") for name in ('stations', 'lines', 'trains', 'wagons')))
+    assert describe_network(loaded) == describe_network(network)
+
+
+def test_generate_network_is_deterministic_for_seed():
+    first = describe_network(generate_network(400, train_count=30, seed=8))
+    assert describe_network(generate_network(400, train_count=30, seed=8)) == first
+    assert describe_network(generate_network(400, train_count=30, seed=9)) != first
+
+
+def test_generate_network_rejects_empty_network():
+    with pytest.raises(ValueError):
+        generate_network(0)
+
+
+@pytest.mark.parametrize("neighbors", [1, 3, 6])
+def test_nearest_stations_match_brute_force(neighbors):
+    rng = random.Random(neighbors)
+    centers = [(rng.uniform(0, 1000), rng.uniform(0, 1000)) for _ in range(8)]
+    coordinates = []
+    for _ in range(750):
+        cx, cy = rng.choice(centers)
+        coordinates.append((max(rng.gauss(cx, 40), 0), max(rng.gauss(cy, 40), 0)))
+
+    for i, nearest in _nearest_stations(coordinates, neighbors):
+        x, y = coordinates[i]
+        distances = sorted(math.dist((x, y), c) for j, c in enumerate(coordinates) if j != i)
+        assert len(nearest) == neighbors and i not in nearest
+        assert sorted(math.dist((x, y), coordinates[j]) for j in nearest) == distances[:neighbors]